@@ -18,181 +18,633 @@ without requiring HTML/CSS/JavaScript knowledge.
 """
 
 import asyncio
+import re
+import time
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+
 import gradio as gr
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.errors.already_exists_error import AlreadyExistsError
+from google.adk.events import Event
 from google.genai import types
 
 # Import the agent and runner from the time_agent package
-from time_agent import runner
+from time_agent import get_current_time, runner
 
 
 # ============================================================================
 # Session Management
 # ============================================================================
 
-# Global Session ID
 # A session is like a "conversation thread". It stores the history
 # of all messages between user and agent.
-# We store the ID globally so it persists across multiple function calls
-# and the conversation can be continued.
-SESSION_ID = None
+# Each browser tab keeps its own session ID in a gr.State (see below), so
+# several users can chat at the same time without sharing their context.
+# The session is created as soon as the page is loaded, so the first
+# message doesn't have to wait for it. It is deleted again when the chat is
+# cleared or the browser tab is closed, so old sessions don't pile up in
+# memory.
+
+# Deletions that run in the background. asyncio only keeps a weak reference
+# to a task, so we hold on to them here until they are done.
+BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+
+async def create_session(session_id: str | None = None) -> str:
+    """
+    Creates a new ADK session for one conversation.
+
+    Args:
+        session_id: The ID for the new session (None for a random ID)
+
+    Returns:
+        The ID of the new session
+    """
+    session = await runner.session_service.create_session(
+        user_id='gradio_user',
+        app_name='root_agent',
+        session_id=session_id
+    )
+    return session.id
+
+
+async def create_first_session(session_id: str) -> str:
+    """
+    Creates the first session of a browser tab, if it doesn't exist yet.
+
+    The first session uses the tab's Gradio session hash as its ID. Page
+    load and the first message may both get here (if the message is sent
+    before the page has finished loading) - the fixed ID makes sure they
+    end up with the same session instead of two.
+
+    Args:
+        session_id: The session hash of the browser tab
+
+    Returns:
+        The ID of the session
+    """
+    try:
+        return await create_session(session_id)
+    except AlreadyExistsError:
+        return session_id
+
+
+async def load_session(request: gr.Request) -> str:
+    """
+    Creates the first session when the page is loaded.
+
+    Args:
+        request: The Gradio request (passed in automatically)
+
+    Returns:
+        The ID of the session (stored in the session state)
+    """
+    return await create_first_session(request.session_hash)
+
+
+async def delete_session(session_id: str):
+    """
+    Deletes an ADK session and the conversation stored in it.
+
+    Args:
+        session_id: The ID of the session to delete
+    """
+    await runner.session_service.delete_session(
+        user_id='gradio_user',
+        app_name='root_agent',
+        session_id=session_id
+    )
+
+
+async def record_turn(session_id: str, message: str, answer: str):
+    """
+    Stores a question and an answer in the session without calling the agent.
+
+    Used for answers we produce ourselves (e.g. simple time questions), so
+    the agent still sees them as part of the conversation later on.
+
+    Args:
+        session_id: The ID of the session
+        message: The user's text message
+        answer: The answer shown to the user
+    """
+    session = await runner.session_service.get_session(
+        user_id='gradio_user',
+        app_name='root_agent',
+        session_id=session_id
+    )
+    if session is None:
+        return
+
+    invocation_id = Event.new_id()
+    await runner.session_service.append_event(session, Event(
+        invocation_id=invocation_id,
+        author='user',
+        content=make_user_content(message)
+    ))
+    await runner.session_service.append_event(session, Event(
+        invocation_id=invocation_id,
+        author=runner.agent.name,
+        content=types.Content(role='model', parts=[types.Part(text=answer)])
+    ))
+
+
+def message_text(message: dict) -> str:
+    """
+    Extracts the text of a chat message from the Gradio chat history.
+
+    Args:
+        message: A message dict with "role" and "content"
+
+    Returns:
+        The text of the message
+    """
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if part.get("type") == "text")
+
+
+async def sync_session(session_id: str, history: list) -> str:
+    """
+    Makes sure the session contains the conversation shown in the chat.
+
+    The "undo" and "retry" buttons of the chat remove the last turn from
+    the screen, but not from the session - the agent would still remember
+    it. If the number of user messages doesn't match anymore, we start a
+    new session and copy the visible conversation into it.
+
+    Args:
+        session_id: The session ID of the browser tab
+        history: The chat history shown on the screen
+
+    Returns:
+        The ID of a session that matches the history
+    """
+    # (question, answer) pairs as shown on the screen
+    turns = []
+    for message in history:
+        if message["role"] == "user":
+            turns.append([message_text(message), ""])
+        elif turns:
+            turns[-1][1] += message_text(message)
+
+    session = await runner.session_service.get_session(
+        user_id='gradio_user',
+        app_name='root_agent',
+        session_id=session_id
+    )
+    if session is None:
+        # The page hasn't finished loading yet - create the first session
+        # here (a new session has no messages)
+        await create_first_session(session_id)
+        user_events = 0
+    else:
+        user_events = sum(1 for event in session.events if event.author == 'user')
+
+    if user_events == len(turns):
+        return session_id
+
+    await delete_session(session_id)
+    session_id = await create_session()
+    for question, answer in turns:
+        await record_turn(session_id, question, answer)
+    return session_id
+
+
+def delete_session_on_close(session_id: str | None):
+    """
+    Deletes the session of a browser tab that was closed.
+
+    Gradio calls this (without awaiting it) when it discards the session
+    state of a closed tab, so we schedule the deletion on the event loop.
+
+    Args:
+        session_id: The session ID stored in the tab's session state
+    """
+    if session_id is not None:
+        task = asyncio.get_running_loop().create_task(delete_session(session_id))
+        BACKGROUND_TASKS.add(task)
+        task.add_done_callback(BACKGROUND_TASKS.discard)
 
 
 # ============================================================================
-# Chat Processing Function (Asynchronous)
+# Agent Communication (Asynchronous)
 # ============================================================================
 
-async def chat_with_agent_async(message: str) -> str:
+def make_user_content(text: str) -> types.Content:
     """
-    Sends a message to the agent and returns the response.
+    Wraps the user's text in a Content object (the message format of ADK).
 
-    Flow:
-    1. Create/reuse session (for conversation context)
-    2. Format message in the correct format (Content object)
-    3. Send message to the agent
-    4. Wait for events and extract final response
+    model_construct() builds the objects without running pydantic's field
+    validation, which is safe here because we always pass valid values.
+
+    Args:
+        text: The user's text message
+
+    Returns:
+        A Content object with the role "user" and a single text part
+    """
+    return types.Content.model_construct(
+        role='user',
+        parts=[types.Part.model_construct(text=text)]
+    )
+
+
+# Simple time questions and the answer template for each language.
+# These questions are answered directly with the tool, without asking the
+# LLM - that is much faster and doesn't use any API quota.
+# A pattern has to match the WHOLE question (after normalize_question), so
+# e.g. "What time is it in Tokyo?" still goes to the agent.
+# Everything else (follow-up questions, other topics, ...) goes to the agent.
+TIME_QUESTIONS = [
+    (
+        re.compile(
+            r"(?:what time is it"
+            r"|what(?:'s| is) the (?:current )?time"
+            r"|(?:(?:can|could) you )?tell me the (?:current )?time"
+            r"|(?:do you know|can you tell me) what time it is"
+            r"|how late is it)"
+            r"(?: right now| now)?(?: please)?"
+        ),
+        "It is currently {time}.",
+    ),
+    (
+        re.compile(
+            r"(?:wie spät ist es"
+            r"|wie ?viel uhr ist es"
+            r"|(?:wie|was) ist die (?:aktuelle )?uhrzeit)"
+            r"(?: jetzt| gerade)?(?: bitte)?"
+        ),
+        "Es ist gerade {time} Uhr.",
+    ),
+]
+
+# Greetings at the start of a question ("Hello, what time is it?")
+GREETING = re.compile(r"^(?:hello|hi|hey|hallo|moin) ")
+
+
+def normalize_question(message: str) -> str:
+    """
+    Brings a question into a simple form for the TIME_QUESTIONS patterns.
+
+    Lowercase, no punctuation, single spaces and no greeting at the start,
+    e.g. "Hello, what's the time?" -> "what's the time".
 
     Args:
         message: The user's text message
 
     Returns:
-        The agent's text response
+        The normalized question
     """
-    global SESSION_ID
+    text = message.lower().replace("’", "'")
+    text = re.sub(r"[^\w\s']", " ", text)
+    text = " ".join(text.split())
+    return GREETING.sub("", text)
 
-    # --- Session Management ---
-    if SESSION_ID is None:
-        session = await runner.session_service.create_session(
-            user_id='gradio_user',
-            app_name='root_agent'
-        )
-        SESSION_ID = session.id
 
+def answer_time_question(message: str) -> str | None:
+    """
+    Answers a simple time question locally, without the LLM.
+
+    Args:
+        message: The user's text message
+
+    Returns:
+        The answer, or None if the message is not a simple time question
+    """
+    question = normalize_question(message)
+    for pattern, template in TIME_QUESTIONS:
+        if pattern.fullmatch(question):
+            return template.format(time=get_current_time()["current_time"])
+    return None
+
+
+# Maximum time (in seconds) to wait for the next event from the agent.
+# Without a limit, a stuck model or tool call would block the chat forever.
+EVENT_TIMEOUT = 30
+
+
+async def stream_agent_response(message: str, session_id: str) -> AsyncIterator[str]:
+    """
+    Sends a message to the agent and streams back the response.
+
+    Flow:
+    1. Format message in the correct format (Content object)
+    2. Send message to the agent with streaming enabled
+    3. Yield the response text as it grows, event by event
+
+    Args:
+        message: The user's text message
+        session_id: The ID of the session (for conversation context)
+
+    Yields:
+        The agent's response text accumulated so far
+    """
     # --- Format Message ---
-    content = types.Content(
-        role='user',
-        parts=[types.Part(text=message)]
-    )
+    content = make_user_content(message)
 
     # --- Execute Agent ---
+    # With StreamingMode.SSE the model sends "partial" events containing
+    # small pieces of text, followed by one complete event per answer.
     response_text = ""
     events_async = runner.run_async(
         user_id='gradio_user',
-        session_id=SESSION_ID,
-        new_message=content
+        session_id=session_id,
+        new_message=content,
+        run_config=RunConfig(streaming_mode=StreamingMode.SSE)
     )
 
     # --- Iterate Through Events ---
-    async for event in events_async:
-        if event.is_final_response() and event.content and event.content.parts:
-            response_text = event.content.parts[0].text
-            break
+    # aclosing() closes the event stream as soon as we leave the block
+    # (also after "break" or an error), which releases the connection to
+    # Gemini right away instead of waiting for the garbage collector.
+    async with aclosing(events_async):
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    anext(events_async), timeout=EVENT_TIMEOUT
+                )
+            except StopAsyncIteration:
+                break
+            except TimeoutError:
+                # The original error has no message - give the user one
+                raise TimeoutError(
+                    f"The agent did not respond within {EVENT_TIMEOUT} seconds."
+                ) from None
+
+            # Tool calls and tool results carry no text
+            text = ""
+            if event.content and event.content.parts:
+                text = "".join(part.text for part in event.content.parts if part.text)
+
+            if text:
+                if event.partial:
+                    response_text += text
+                else:
+                    response_text = text
+                yield response_text
+
+            if event.is_final_response():
+                break
+
+            # A complete event that is not the final one ends a model response
+            # (e.g. right before a tool call). The next response starts fresh,
+            # so its text isn't glued to the end of the previous one.
+            if not event.partial:
+                response_text = ""
+
+
+# ============================================================================
+# Response Cache
+# ============================================================================
+
+# The agent only knows the time to the minute, so the same question asked
+# twice within a short time gets the same answer. We remember answers for
+# CACHE_TTL seconds, keyed by (message, current minute).
+# Only the first message of a conversation is cached: later answers depend
+# on what was said before in that session, so they can't be shared.
+CACHE_TTL = 30
 
-    return response_text
+# (message, "HH:MM") -> (time stored, answer)
+RESPONSE_CACHE: dict[tuple[str, str], tuple[float, str]] = {}
+
+# One lock per key: if the same question arrives several times at once,
+# only the first one asks the agent and the others wait for its answer.
+RESPONSE_LOCKS: dict[tuple[str, str], asyncio.Lock] = {}
+
+
+def get_cached_response(key: tuple[str, str]) -> str | None:
+    """
+    Looks up a cached answer that is not older than CACHE_TTL.
+
+    Args:
+        key: Tuple of (message, current minute)
+
+    Returns:
+        The cached answer, or None if there is no fresh one
+    """
+    entry = RESPONSE_CACHE.get(key)
+    if entry is not None and time.monotonic() - entry[0] < CACHE_TTL:
+        return entry[1]
+    return None
+
+
+def store_response(key: tuple[str, str], response_text: str):
+    """
+    Stores an answer in the cache and removes expired entries.
+
+    Args:
+        key: Tuple of (message, current minute)
+        response_text: The agent's complete answer
+    """
+    now = time.monotonic()
+    for old_key, (stored_at, _) in list(RESPONSE_CACHE.items()):
+        if now - stored_at >= CACHE_TTL:
+            del RESPONSE_CACHE[old_key]
+    RESPONSE_CACHE[key] = (now, response_text)
 
 
 # ============================================================================
-# Synchronous Wrapper for Gradio
+# Chat Processing Function (Asynchronous)
 # ============================================================================
 
-def chat_with_agent(message: str, history: list) -> str:
+async def chat_with_agent_async(
+    message: str, session_id: str, first_message: bool
+) -> AsyncIterator[str]:
     """
-    Synchronous wrapper for asynchronous agent communication.
+    Answers a message, using the agent only when necessary.
+
+    Flow:
+    1. Answer simple time questions directly (no LLM needed)
+    2. Later messages of a conversation go straight to the agent
+    3. Return a cached answer if the same question was just asked
+    4. Otherwise stream the answer from the agent and cache it
 
     Args:
         message: The user's text message
-        history: The previous chat history (managed by Gradio, not used here)
+        session_id: The ID of the session (for conversation context)
+        first_message: True if this is the first message of the conversation
 
-    Returns:
-        The agent's text response, or an error message
+    Yields:
+        The response text accumulated so far
     """
+    # --- Shortcut for Simple Time Questions ---
+    answer = answer_time_question(message)
+    if answer is not None:
+        # Store the turn, so follow-up questions ("and in Berlin?") have
+        # the context they refer to
+        await record_turn(session_id, message, answer)
+        yield answer
+        return
+
+    # --- Conversation With Context ---
+    if not first_message:
+        async for response_text in stream_agent_response(message, session_id):
+            yield response_text
+        return
+
+    # --- Cache Lookup ---
+    key = (message, time.strftime("%H:%M"))
+    cached = get_cached_response(key)
+    if cached is not None:
+        await record_turn(session_id, message, cached)
+        yield cached
+        return
+
+    lock = RESPONSE_LOCKS.setdefault(key, asyncio.Lock())
     try:
-        response = asyncio.run(chat_with_agent_async(message))
-        return response
-    except Exception as e:
-        return f"Error: {str(e)}"
+        async with lock:
+            # Another request may have stored the answer while we were waiting
+            cached = get_cached_response(key)
+            if cached is not None:
+                await record_turn(session_id, message, cached)
+                yield cached
+                return
+
+            # --- Ask the Agent ---
+            response_text = ""
+            async for response_text in stream_agent_response(message, session_id):
+                yield response_text
+
+            if response_text:
+                store_response(key, response_text)
+    finally:
+        # Remove the lock when nobody holds it anymore (also after an
+        # error or a timeout), so RESPONSE_LOCKS doesn't keep growing
+        if not lock.locked() and RESPONSE_LOCKS.get(key) is lock:
+            del RESPONSE_LOCKS[key]
 
 
-def reset_session():
+# ============================================================================
+# Session Reset
+# ============================================================================
+
+async def reset_session(session_id: str | None) -> str:
     """
     Resets the session to start a new conversation.
 
+    Called when the chat is cleared with the trash icon of the chatbot.
+
+    Args:
+        session_id: The ID of the old session (deleted here)
+
     Returns:
-        Empty list to clear the chat history in the UI
+        The ID of a fresh session (stored in the session state)
     """
-    global SESSION_ID
-    SESSION_ID = None
-    return []
+    if session_id is not None:
+        await delete_session(session_id)
+    return await create_session()
 
 
 # ============================================================================
 # Gradio User Interface
 # ============================================================================
 
+# --- Event Handler Function ---
+async def respond(
+    message: str, history: list, session_id: str | None, request: gr.Request
+) -> AsyncIterator[tuple[str, str]]:
+    """
+    Processes the user message and streams the answer into the chat.
+
+    Because this function is an "async generator", Gradio runs it
+    directly on its event loop and updates the UI after every "yield".
+    The user sees the answer appear while it is still being generated.
+
+    gr.ChatInterface adds the user message and the answer to the chat
+    history itself, so we only yield the answer text (and the session ID
+    for the session state).
+
+    Args:
+        message: The user's entered message
+        history: The previous chat history (managed by gr.ChatInterface)
+        session_id: The session ID of this browser tab (None if the page
+            hasn't finished loading yet; then the tab's first session is
+            used, see create_first_session)
+        request: The Gradio request (passed in automatically)
+
+    Yields:
+        Tuple of:
+        - The answer text generated so far
+        - session_id (stored in the session state)
+    """
+    if session_id is None:
+        session_id = request.session_hash
+
+    try:
+        # Replaces the session if it doesn't match the chat anymore (after
+        # undo or retry) or doesn't exist yet
+        session_id = await sync_session(session_id, history)
+
+        # After sync_session the session holds exactly the turns of the
+        # history, so an empty history means a new conversation
+        async for partial in chat_with_agent_async(message, session_id, not history):
+            yield partial, session_id
+    except Exception as e:
+        yield f"Error: {str(e)}", session_id
+
+
 with gr.Blocks(title="Google ADK Time Agent") as demo:
 
     # --- Headings ---
     gr.Markdown("# Time Agent with Google ADK")
-    gr.Markdown("Ask the agent for the current time! The agent itself doesn't know what time it is – it must use its tool.")
-
-    # --- Chatbot Component ---
-    chatbot = gr.Chatbot(
-        label="Chat",
-        height=400
-    )
-
-    # --- Text Input ---
-    msg = gr.Textbox(
-        label="Your Message",
-        placeholder="e.g., 'What time is it?' or 'How late is it?'",
-        lines=1
+    gr.Markdown("Ask the agent about the current time! Simple questions like \"What time is it?\" are answered directly by the app, without the LLM. Everything else goes to the agent – it doesn't know what time it is itself, so it must use its tool.")
+
+    # --- Session State ---
+    # gr.State holds a separate value for every browser tab
+    session_state = gr.State(None, delete_callback=delete_session_on_close)
+
+    # --- Chat Interface ---
+    # gr.ChatInterface combines the chatbot, the text input and the event
+    # handling. It calls respond(message, history, session_id) for every
+    # message and shows each yielded text as the (growing) answer.
+    # The session ID is passed in and out, in case respond has to replace it.
+    # Note: respond is not registered with batch=True. Gradio cannot batch
+    # generator functions (we stream the answer), and every message belongs
+    # to its own ADK session, so there is no shared Gemini call to combine.
+    # Concurrent messages still run side by side on the event loop.
+    chat = gr.ChatInterface(
+        fn=respond,
+        chatbot=gr.Chatbot(
+            label="Chat",
+            height=400
+        ),
+        textbox=gr.Textbox(
+            label="Your Message",
+            placeholder="e.g., 'What time is it?' or 'How many minutes are left until midnight?'",
+            lines=1
+        ),
+        additional_inputs=[session_state],
+        additional_outputs=[session_state],
     )
 
-    # --- Reset Button ---
-    clear = gr.Button("Clear Chat")
-
     # --- Examples ---
+    # Clicking an example fills in the text field.
+    # The first two are answered directly by the app (see TIME_QUESTIONS),
+    # the others go to the agent, which calls its tool.
     gr.Examples(
         examples=[
             ["What time is it?"],
-            ["Can you tell me the time?"],
-            ["What's the current time?"],
-            ["Hello, do you know what time it is right now?"],
+            ["Wie spät ist es?"],
+            ["How many minutes are left until midnight?"],
+            ["Is it already afternoon?"],
         ],
-        inputs=msg
+        inputs=chat.textbox
     )
 
-    # --- Event Handler Function ---
-    def respond(message: str, chat_history: list):
-        """
-        Processes the user message and updates the chat.
-
-        Args:
-            message: The user's entered message
-            chat_history: The previous chat history (list of dicts)
-
-        Returns:
-            Tuple of:
-            - "" (empty string to clear the text field)
-            - chat_history (updated chat history)
-        """
-        bot_response = chat_with_agent(message, chat_history)
-
-        chat_history.append({"role": "user", "content": message})
-        chat_history.append({"role": "assistant", "content": bot_response})
-
-        return "", chat_history
-
     # --- Connect Events ---
-    msg.submit(
-        fn=respond,
-        inputs=[msg, chatbot],
-        outputs=[msg, chatbot]
+    chat.chatbot.clear(
+        fn=reset_session,
+        inputs=session_state,
+        outputs=session_state
     )
 
-    clear.click(
-        fn=reset_session,
+    demo.load(
+        fn=load_session,
         inputs=None,
-        outputs=chatbot
+        outputs=session_state
     )
 
 
@@ -201,4 +653,10 @@ with gr.Blocks(title="Google ADK Time Agent") as demo:
 # ============================================================================
 
 if __name__ == "__main__":
+    # uvloop (a faster event loop, see pyproject.toml) needs no setup here:
+    # Gradio runs its web server with uvicorn's default loop="auto", which
+    # uses uvloop automatically when it is installed.
+    # The queue lets many requests wait for Gemini at the same time.
+    # Answers are mostly network waiting, so a high limit is cheap.
+    demo.queue(default_concurrency_limit=32, max_size=128)
     demo.launch()
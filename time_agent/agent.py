@@ -5,20 +5,41 @@ This module defines the agent that can tell the current time.
 It can be used with both ADK web and Gradio interfaces.
 """
 
+import os
+import textwrap
+
 from dotenv import load_dotenv
 from google.adk.agents.llm_agent import Agent
+from google.adk.models import Gemini
 from google.adk.runners import InMemoryRunner
 
 from .tools import get_current_time
 
 # Load environment variables (e.g., GOOGLE_API_KEY from .env file)
-load_dotenv()
+# Skipped if the key is already set, e.g. exported in the shell
+if not os.getenv("GOOGLE_API_KEY"):
+    load_dotenv()
+
+
+# The "personality" and behavioral instructions for the agent
+# dedent() removes the indentation and strip() the empty first and last
+# lines - every character is sent to the model with each request.
+INSTRUCTION = textwrap.dedent("""
+    You are a helpful assistant.
+    When the user asks for the time, use the 'get_current_time' tool.
+    Respond in the same language as the user's question.
+    Be friendly and precise in your answer.
+""").strip()
 
 
 # Create the Time Agent
 root_agent = Agent(
-    # The AI model used (Gemini 2.0 Flash is fast and efficient)
-    model='gemini-2.0-flash',
+    # The AI model used (Gemini 2.0 Flash-Lite is the smallest and fastest
+    # Flash model - enough for recognizing a time question and calling a tool)
+    # We pass a Gemini object instead of just the model name: with a name,
+    # ADK creates a new model client (and new connections) for every
+    # request, while one object keeps its client and reuses connections.
+    model=Gemini(model='gemini-2.0-flash-lite'),
 
     # Internal name of the agent (for logging and referencing)
     name='root_agent',
@@ -26,14 +47,8 @@ root_agent = Agent(
     # Brief description of what the agent can do
     description="A helpful assistant that can tell the current time.",
 
-    # The "personality" and behavioral instructions for the agent
-    instruction="""
-    You are a helpful assistant.
-    When the user asks for the time, use the 'get_current_time' tool.
-    You yourself do NOT know what time it is - you MUST use the tool!
-    Respond in the same language as the user's question.
-    Be friendly and precise in your answer.
-    """,
+    # The behavioral instructions (defined above)
+    instruction=INSTRUCTION,
 
     # List of available tools that the agent can call
     tools=[get_current_time],